@@ -4,33 +4,36 @@
 """
 import os
 import sys
-import subprocess
+import importlib.util
 # 修复 Windows 上 playwright 的 asyncio 兼容性问题
 os.environ.setdefault("PLAYWRIGHT_BROWSERS_PATH", "0")
 
 import asyncio
 import time
 import re
-import random
+import functools
+import itertools
+import json
+import contextlib
 from pathlib import Path
-from typing import Optional, Dict
-from datetime import datetime
-from urllib.parse import urlparse, unquote
+from typing import Optional, Dict, List
+from urllib.parse import urlsplit
 
 from ..core.logger import debug_logger
 
 
 # ==================== Docker 环境检测 ====================
+@functools.lru_cache(maxsize=1)
 def _is_running_in_docker() -> bool:
-    """检测是否在 Docker 容器中运行"""
+    """检测是否在 Docker 容器中运行（结果在进程内缓存）"""
     # 方法1: 检查 /.dockerenv 文件
     if os.path.exists('/.dockerenv'):
         return True
-    # 方法2: 检查 cgroup
+    # 方法2: 检查 cgroup（按字节读取，省去解码）
     try:
-        with open('/proc/1/cgroup', 'r') as f:
+        with open('/proc/1/cgroup', 'rb') as f:
             content = f.read()
-            if 'docker' in content or 'kubepods' in content or 'containerd' in content:
+            if any(s in content for s in (b'docker', b'kubepods', b'containerd')):
                 return True
     except:
         pass
@@ -44,7 +47,73 @@ IS_DOCKER = _is_running_in_docker()
 
 
 # ==================== playwright 自动安装 ====================
-def _run_pip_install(package: str, use_mirror: bool = False) -> bool:
+# 直接按 playwright 的规则校验 chromium 安装目录，无需启动 node driver
+
+
+def _playwright_package_dir() -> Optional[Path]:
+    """playwright 自带 driver 的 package 目录"""
+    spec = importlib.util.find_spec("playwright")
+    if not spec or not spec.origin:
+        return None
+    return Path(spec.origin).parent / "driver" / "package"
+
+
+def _playwright_browsers_dir() -> Optional[Path]:
+    """按 playwright 的规则推算浏览器安装目录"""
+    env_path = os.environ.get("PLAYWRIGHT_BROWSERS_PATH")
+    if env_path == "0":
+        package_dir = _playwright_package_dir()
+        return package_dir / ".local-browsers" if package_dir else None
+    if env_path:
+        return Path(env_path)
+    if sys.platform == "win32":
+        return Path(os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local") / "ms-playwright"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "ms-playwright"
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "ms-playwright"
+
+
+def _find_chromium() -> Optional[str]:
+    """查找当前 playwright 版本所需 revision 的 chromium 目录
+
+    playwright 升级后旧 revision 目录仍会保留，所以必须按 browsers.json
+    中的 revision 定位，并以 playwright 安装完成时写入的标记文件为准
+    """
+    package_dir = _playwright_package_dir()
+    browsers_dir = _playwright_browsers_dir()
+    if not package_dir or not browsers_dir:
+        return None
+    try:
+        with open(package_dir / "browsers.json", encoding="utf-8") as f:
+            browsers = json.load(f)["browsers"]
+        revision = next(b["revision"] for b in browsers if b["name"] == "chromium")
+    except (OSError, ValueError, KeyError, StopIteration):
+        return None
+    browser_dir = browsers_dir / f"chromium-{revision}"
+    if (browser_dir / "INSTALLATION_COMPLETE").exists():
+        return str(browser_dir)
+    return None
+
+
+async def _run_install_cmd(cmd: list, timeout: float, env: Optional[dict] = None) -> tuple:
+    """异步运行安装命令，丢弃 stdout，只收集 stderr，返回 (returncode, stderr)"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+    )
+    try:
+        async with asyncio.timeout(timeout):
+            _, stderr = await proc.communicate()
+    except TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise RuntimeError(f"安装超时 ({timeout}s)")
+    return proc.returncode, stderr.decode("utf-8", errors="replace")
+
+
+async def _run_pip_install(package: str, use_mirror: bool = False) -> bool:
     """运行 pip install 命令"""
     cmd = [sys.executable, '-m', 'pip', 'install', package]
     if use_mirror:
@@ -53,20 +122,20 @@ def _run_pip_install(package: str, use_mirror: bool = False) -> bool:
     try:
         debug_logger.log_info(f"[BrowserCaptcha] 正在安装 {package}...")
         print(f"[BrowserCaptcha] 正在安装 {package}...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        if result.returncode == 0:
+        returncode, stderr = await _run_install_cmd(cmd, timeout=300)
+        if returncode == 0:
             debug_logger.log_info(f"[BrowserCaptcha] ✅ {package} 安装成功")
             print(f"[BrowserCaptcha] ✅ {package} 安装成功")
             return True
         else:
-            debug_logger.log_warning(f"[BrowserCaptcha] {package} 安装失败: {result.stderr[:200]}")
+            debug_logger.log_warning(f"[BrowserCaptcha] {package} 安装失败: {stderr[:200]}")
             return False
     except Exception as e:
         debug_logger.log_warning(f"[BrowserCaptcha] {package} 安装异常: {e}")
         return False
 
 
-def _run_playwright_install(use_mirror: bool = False) -> bool:
+async def _run_playwright_install(use_mirror: bool = False) -> bool:
     """安装 playwright chromium 浏览器"""
     cmd = [sys.executable, '-m', 'playwright', 'install', 'chromium']
     env = os.environ.copy()
@@ -78,39 +147,36 @@ def _run_playwright_install(use_mirror: bool = False) -> bool:
     try:
         debug_logger.log_info("[BrowserCaptcha] 正在安装 chromium 浏览器...")
         print("[BrowserCaptcha] 正在安装 chromium 浏览器...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600, env=env)
-        if result.returncode == 0:
+        returncode, stderr = await _run_install_cmd(cmd, timeout=600, env=env)
+        if returncode == 0:
             debug_logger.log_info("[BrowserCaptcha] ✅ chromium 浏览器安装成功")
             print("[BrowserCaptcha] ✅ chromium 浏览器安装成功")
             return True
         else:
-            debug_logger.log_warning(f"[BrowserCaptcha] chromium 安装失败: {result.stderr[:200]}")
+            debug_logger.log_warning(f"[BrowserCaptcha] chromium 安装失败: {stderr[:200]}")
             return False
     except Exception as e:
         debug_logger.log_warning(f"[BrowserCaptcha] chromium 安装异常: {e}")
         return False
 
 
-def _ensure_playwright_installed() -> bool:
+async def _ensure_playwright_installed() -> bool:
     """确保 playwright 已安装"""
-    try:
-        import playwright
+    if importlib.util.find_spec("playwright") is not None:
         debug_logger.log_info("[BrowserCaptcha] playwright 已安装")
         return True
-    except ImportError:
-        pass
     
     debug_logger.log_info("[BrowserCaptcha] playwright 未安装，开始自动安装...")
     print("[BrowserCaptcha] playwright 未安装，开始自动安装...")
     
     # 先尝试官方源
-    if _run_pip_install('playwright', use_mirror=False):
+    if await _run_pip_install('playwright', use_mirror=False):
         return True
     
     # 官方源失败，尝试国内镜像
     debug_logger.log_info("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
     print("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
-    if _run_pip_install('playwright', use_mirror=True):
+    if await _run_pip_install('playwright', use_mirror=True):
         return True
     
     debug_logger.log_error("[BrowserCaptcha] ❌ playwright 自动安装失败，请手动安装: pip install playwright")
@@ -118,30 +184,27 @@ def _ensure_playwright_installed() -> bool:
     return False
 
 
-def _ensure_browser_installed() -> bool:
+async def _ensure_browser_installed() -> bool:
     """确保 chromium 浏览器已安装"""
     try:
-        from playwright.sync_api import sync_playwright
-        with sync_playwright() as p:
-            # 尝试获取浏览器路径，如果失败说明未安装
-            browser_path = p.chromium.executable_path
-            if browser_path and os.path.exists(browser_path):
-                debug_logger.log_info(f"[BrowserCaptcha] chromium 浏览器已安装: {browser_path}")
-                return True
+        # 只检查安装目录，不进入 sync_playwright()（会启动 node driver）
+        browser_path = _find_chromium()
+        if browser_path:
+            debug_logger.log_info(f"[BrowserCaptcha] chromium 浏览器已安装: {browser_path}")
+            return True
     except Exception as e:
         debug_logger.log_info(f"[BrowserCaptcha] 检测浏览器时出错: {e}")
     
     debug_logger.log_info("[BrowserCaptcha] chromium 浏览器未安装，开始自动安装...")
     print("[BrowserCaptcha] chromium 浏览器未安装，开始自动安装...")
     
-    # 先尝试官方源
-    if _run_playwright_install(use_mirror=False):
-        return True
-    
-    # 官方源失败，尝试国内镜像
-    debug_logger.log_info("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
-    print("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
-    if _run_playwright_install(use_mirror=True):
+    # 先尝试官方源，失败后尝试国内镜像
+    installed = await _run_playwright_install(use_mirror=False)
+    if not installed:
+        debug_logger.log_info("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
+        print("[BrowserCaptcha] 官方源安装失败，尝试国内镜像...")
+        installed = await _run_playwright_install(use_mirror=True)
+    if installed:
         return True
     
     debug_logger.log_error("[BrowserCaptcha] ❌ chromium 浏览器自动安装失败，请手动安装: python -m playwright install chromium")
@@ -159,37 +222,185 @@ if IS_DOCKER:
     debug_logger.log_warning("[BrowserCaptcha] 检测到 Docker 环境，有头浏览器打码不可用，请使用第三方打码服务")
     print("[BrowserCaptcha] ⚠️ 检测到 Docker 环境，有头浏览器打码不可用")
     print("[BrowserCaptcha] 请使用第三方打码服务: yescaptcha, capmonster, ezcaptcha, capsolver")
-else:
-    if _ensure_playwright_installed():
-        try:
-            from playwright.async_api import async_playwright, Route, BrowserContext
-            PLAYWRIGHT_AVAILABLE = True
-            # 检查并安装浏览器
-            _ensure_browser_installed()
-        except ImportError as e:
-            debug_logger.log_error(f"[BrowserCaptcha] playwright 导入失败: {e}")
-            print(f"[BrowserCaptcha] ❌ playwright 导入失败: {e}")
+
+
+def _import_playwright() -> bool:
+    """导入 playwright（已安装时开销很小，可在导入模块时直接调用）"""
+    global async_playwright, Route, BrowserContext, PLAYWRIGHT_AVAILABLE
+    try:
+        from playwright.async_api import async_playwright, Route, BrowserContext
+        PLAYWRIGHT_AVAILABLE = True
+    except ImportError as e:
+        debug_logger.log_error(f"[BrowserCaptcha] playwright 导入失败: {e}")
+        print(f"[BrowserCaptcha] ❌ playwright 导入失败: {e}")
+    return PLAYWRIGHT_AVAILABLE
+
+
+async def _bootstrap() -> bool:
+    """按需安装 playwright 和 chromium，安装过程不阻塞事件循环"""
+    if IS_DOCKER:
+        return False
+    if not PLAYWRIGHT_AVAILABLE:
+        if not await _ensure_playwright_installed() or not _import_playwright():
+            return False
+    # 检查并安装浏览器
+    await _ensure_browser_installed()
+    return True
+
+
+_BOOTSTRAP_TASK: Optional[asyncio.Future] = None
+
+
+def _ensure_bootstrapped() -> asyncio.Future:
+    """在当前事件循环上只调度一次 _bootstrap，之后复用同一个任务"""
+    global _BOOTSTRAP_TASK
+    if _BOOTSTRAP_TASK is None:
+        _BOOTSTRAP_TASK = asyncio.ensure_future(_bootstrap())
+    return _BOOTSTRAP_TASK
+
+
+if not IS_DOCKER:
+    if importlib.util.find_spec("playwright") is not None:
+        _import_playwright()
+    # 模块在运行中的事件循环里被导入时立即开始后台安装，get_instance 会等待它完成
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        _ensure_bootstrapped()
 
 
 # 配置
 LABS_URL = "https://labs.google/fx/tools/flow"
 
+# 打码页只拦截 reCAPTCHA 相关域名以外的请求，放行的请求不会回调到 Python
+_NON_RECAPTCHA_RE = re.compile(r'^(?!https?://([^/]+\.)?(google\.com|gstatic\.com|recaptcha\.net)/)')
+
+
+# 页面初始化脚本：隐藏 webdriver 标记，并预先定义打码函数，
+# 之后每次只需通过 CDP 传入 website_key/action，不再下发整段 JS
+_PAGE_INIT_JS = """
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+// 在页面内等待 grecaptcha 加载完成，Python 端只需一次 evaluate 等待该 Promise
+window.__grecaptchaReady = new Promise(resolve => {
+    const check = () => (typeof grecaptcha !== 'undefined' && grecaptcha.enterprise)
+        ? grecaptcha.enterprise.ready(resolve)
+        : setTimeout(check, 20);
+    check();
+});
+window.__solve = (websiteKey, actionName) => new Promise((resolve, reject) => {
+    const timeout = setTimeout(() => reject(new Error('timeout')), 25000);
+    grecaptcha.enterprise.execute(websiteKey, {action: actionName})
+        .then(t => { clearTimeout(timeout); resolve(t); })
+        .catch(e => { clearTimeout(timeout); reject(e); });
+});
+"""
+
+_READY_JS = "() => window.__grecaptchaReady"
+_SOLVE_JS = "([k, a]) => window.__solve(k, a)"
+
+# 读取 antcpt.com 分数检测页上的分数、UA 和 IP
+_READ_SCORE_JS = """
+(() => {
+    const bodyText = ((document.body && document.body.innerText) || "")
+        .replace(/\\u00a0/g, " ").replace(/\\r/g, "");
+    const patterns = [
+        { source: "current_score", regex: /Your score is:\\s*([01](?:\\.\\d+)?)/i },
+        { source: "selected_score", regex: /Selected Score Test:[\\s\\S]{0,400}?Score:\\s*([01](?:\\.\\d+)?)/i },
+        { source: "history_score", regex: /(?:^|\\n)\\s*Score:\\s*([01](?:\\.\\d+)?)\\s*;/i },
+    ];
+    let score = null; let source = "";
+    for (const item of patterns) {
+        const match = bodyText.match(item.regex);
+        if (!match) continue;
+        const parsed = Number(match[1]);
+        if (!Number.isNaN(parsed) && parsed >= 0 && parsed <= 1) {
+            score = parsed; source = item.source; break;
+        }
+    }
+    const uaMatch = bodyText.match(/Current User Agent:\\s*([^\\n]+)/i);
+    const ipMatch = bodyText.match(/Current IP Address:\\s*([^\\n]+)/i);
+    return { score, source, raw_text: bodyText.slice(0, 4000),
+             current_user_agent: uaMatch ? uaMatch[1].trim() : "",
+             current_ip_address: ipMatch ? ipMatch[1].trim() : "" };
+})()
+"""
+
+
+@functools.lru_cache(maxsize=8)
+def _recaptcha_page_html(website_key: str) -> str:
+    """打码用的空白页面，只加载 reCAPTCHA Enterprise 脚本"""
+    return f"""<html><head><script src="https://www.google.com/recaptcha/enterprise.js?render={website_key}"></script></head><body></body></html>"""
+
+
+# 进程内共享的 playwright driver（node 子进程），避免每次打码都重新启动
+_PW_SINGLETON = None
+_PW_LOCK: Optional[asyncio.Lock] = None  # 首次使用时创建，避免导入时创建事件循环对象
+
+
+def _pw_lock() -> asyncio.Lock:
+    global _PW_LOCK
+    if _PW_LOCK is None:
+        _PW_LOCK = asyncio.Lock()
+    return _PW_LOCK
+
+
+def _playwright_alive(playwright) -> bool:
+    """driver 进程退出后 connection 会记录 _closed_error"""
+    connection = getattr(playwright, "_connection", None)
+    return getattr(connection, "_closed_error", None) is None
+
+
+async def _get_playwright():
+    """懒加载共享的 playwright driver，整个进程只启动一次（driver 退出后自动重启）"""
+    global _PW_SINGLETON
+    if _PW_SINGLETON is None or not _playwright_alive(_PW_SINGLETON):
+        async with _pw_lock():
+            if _PW_SINGLETON is None or not _playwright_alive(_PW_SINGLETON):
+                _PW_SINGLETON = await async_playwright().start()
+    return _PW_SINGLETON
+
+
+async def _stop_playwright():
+    """停止共享的 playwright driver（服务关闭时调用）"""
+    global _PW_SINGLETON
+    async with _pw_lock():
+        playwright, _PW_SINGLETON = _PW_SINGLETON, None
+        if playwright:
+            try:
+                await playwright.stop()
+            except Exception:
+                pass
+
 # ==========================================
 # 代理解析工具函数
 # ==========================================
+_PROXY_SCHEMES = ('http', 'https', 'socks5')
+
+
 def parse_proxy_url(proxy_url: str) -> Optional[Dict[str, str]]:
-    """解析代理URL"""
+    """解析代理URL（协议可省略，缺省为 http）"""
     if not proxy_url: return None
-    if not re.match(r'^(http|https|socks5)://', proxy_url): proxy_url = f"http://{proxy_url}"
-    match = re.match(r'^(socks5|http|https)://(?:([^:]+):([^@]+)@)?([^:]+):(\d+)$', proxy_url)
-    if match:
-        protocol, username, password, host, port = match.groups()
-        proxy_config = {'server': f'{protocol}://{host}:{port}'}
-        if username and password:
-            proxy_config['username'] = username
-            proxy_config['password'] = password
-        return proxy_config
-    return None
+    scheme, sep, rest = proxy_url.partition('://')
+    if not sep: scheme, rest = 'http', proxy_url
+    # 密码里可能有 / ? # 等字符，urlsplit 会在这些字符处截断 netloc，
+    # 所以先在最后一个 @ 处切出认证信息，只把 host:port 交给 urlsplit
+    creds, _, hostport = rest.rpartition('@')
+    try:
+        parts = urlsplit('//' + hostport)
+        port = parts.port
+    except ValueError:
+        return None
+    host = parts.hostname
+    if scheme not in _PROXY_SCHEMES or not host or not port or parts.netloc != hostport:
+        return None
+    proxy_config = {'server': f'{scheme}://{host}:{port}'}
+    username, _, password = creds.partition(':')
+    if username and password:
+        proxy_config['username'] = username
+        proxy_config['password'] = password
+    return proxy_config
 
 def validate_browser_proxy_url(proxy_url: str) -> tuple[bool, str]:
     if not proxy_url: return True, None
@@ -206,18 +417,22 @@ class TokenBrowser:
 
     CDP_ENDPOINT = "http://127.0.0.1:9222"
 
+    __slots__ = ('token_id', 'user_data_dir', 'db', '_lock', '_solve_count', '_error_count')
+
     def __init__(self, token_id: int, user_data_dir: str, db=None):
         self.token_id = token_id
         self.user_data_dir = user_data_dir  # unused with CDP, kept for compat
         self.db = db
-        self._semaphore = asyncio.Semaphore(1)
+        # 同一实例仅在请求数超过浏览器数时才会并发，此时只串行化连接+打码
+        self._lock = asyncio.Lock()
         self._solve_count = 0
         self._error_count = 0
 
     async def _create_browser(self) -> tuple:
-        """Connect to running Chrome instance via CDP, returns (playwright, browser, context)"""
-        playwright = await async_playwright().start()
+        """Connect to running Chrome instance via CDP, returns (browser, context)"""
+        playwright = await _get_playwright()
 
+        browser = None
         try:
             browser = await playwright.chromium.connect_over_cdp(self.CDP_ENDPOINT)
             contexts = browser.contexts
@@ -226,44 +441,36 @@ class TokenBrowser:
             else:
                 context = await browser.new_context()
             debug_logger.log_info(f"[BrowserCaptcha] Token-{self.token_id} connected to Chrome via CDP")
-            return playwright, browser, context
+            return browser, context
         except Exception as e:
             debug_logger.log_error(f"[BrowserCaptcha] Token-{self.token_id} CDP connection failed: {type(e).__name__}: {str(e)[:200]}")
-            try:
-                await playwright.stop()
-            except: pass
+            # 已连上但建 context 失败时，调用方拿不到 browser，需在这里断开
+            await self._close_browser(browser, None)
             raise
 
-    async def _close_browser(self, playwright, browser, context):
-        """Disconnect from Chrome (do NOT close browser/context - Chrome keeps running)"""
+    async def _close_browser(self, browser, context):
+        """Disconnect from Chrome (do NOT close browser/context - Chrome keeps running)
+
+        共享的 playwright driver 保持运行，只断开 CDP 连接
+        """
         try:
             if browser:
                 await browser.close()
-        except: pass
-        try:
-            if playwright:
-                await playwright.stop()
-        except: pass
+        except Exception: pass
     
     async def _execute_captcha(self, context, project_id: str, website_key: str, action: str) -> Optional[str]:
         """在给定 context 中执行打码逻辑"""
         page = None
         try:
             page = await context.new_page()
-            await page.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined});")
+            await page.add_init_script(_PAGE_INIT_JS)
             
             page_url = f"https://labs.google/fx/tools/flow/project/{project_id}"
             
-            async def handle_route(route):
-                if route.request.url.rstrip('/') == page_url.rstrip('/'):
-                    html = f"""<html><head><script src="https://www.google.com/recaptcha/enterprise.js?render={website_key}"></script></head><body></body></html>"""
-                    await route.fulfill(status=200, content_type="text/html", body=html)
-                elif any(d in route.request.url for d in ["google.com", "gstatic.com", "recaptcha.net"]):
-                    await route.continue_()
-                else:
-                    await route.abort()
-            
-            await page.route("**/*", handle_route)
+            html = _recaptcha_page_html(website_key)
+            # 路由按注册的逆序匹配：先注册非 Google 请求的 abort，最后拦截主页面
+            await page.route(_NON_RECAPTCHA_RE, lambda route: route.abort())
+            await page.route(page_url, lambda route: route.fulfill(status=200, content_type="text/html", body=html))
             try:
                 await page.goto(page_url, wait_until="load", timeout=30000)
             except Exception as e:
@@ -271,25 +478,14 @@ class TokenBrowser:
                 return None
             
             try:
-                await page.wait_for_function("typeof grecaptcha !== 'undefined'", timeout=15000)
+                async with asyncio.timeout(15):
+                    await page.evaluate(_READY_JS)
             except Exception as e:
                 debug_logger.log_warning(f"[BrowserCaptcha] Token-{self.token_id} grecaptcha 未就绪: {type(e).__name__}: {str(e)[:200]}")
                 return None
 
-            token = await asyncio.wait_for(
-                page.evaluate(f"""
-                    (actionName) => {{
-                        return new Promise((resolve, reject) => {{
-                            const timeout = setTimeout(() => reject(new Error('timeout')), 25000);
-                            grecaptcha.enterprise.execute('{website_key}', {{action: actionName}})
-                                .then(t => {{ resolve(t); }})
-                                .catch(e => {{ reject(e); }});
-                        }});
-                    }}
-                """, action),
-                timeout=30
-            )
-            return token
+            async with asyncio.timeout(30):
+                return await page.evaluate(_SOLVE_JS, [website_key, action])
         except Exception as e:
             msg = f"{type(e).__name__}: {str(e)}"
             debug_logger.log_warning(f"[BrowserCaptcha] Token-{self.token_id} 打码失败: {msg[:200]}")
@@ -297,46 +493,45 @@ class TokenBrowser:
         finally:
             if page:
                 try: await page.close()
-                except: pass
+                except Exception: pass
     
     async def get_token(self, project_id: str, website_key: str, action: str = "IMAGE_GENERATION") -> Optional[str]:
         """获取 Token：启动新浏览器 -> 打码 -> 关闭浏览器"""
-        async with self._semaphore:
-            MAX_RETRIES = 3
-            
-            for attempt in range(MAX_RETRIES):
-                playwright = None
-                browser = None
-                context = None
-                try:
-                    start_ts = time.time()
-                    
-                    # 每次都启动新浏览器（新 UA）
-                    playwright, browser, context = await self._create_browser()
-                    
+        MAX_RETRIES = 3
+        
+        for attempt in range(MAX_RETRIES):
+            browser = None
+            context = None
+            try:
+                start_ts = time.time()
+                
+                async with self._lock:
+                    # 每次都重新连接浏览器（复用 playwright driver）
+                    browser, context = await self._create_browser()
+
                     # 执行打码
                     token = await self._execute_captcha(context, project_id, website_key, action)
-                    
-                    if token:
-                        self._solve_count += 1
-                        debug_logger.log_info(f"[BrowserCaptcha] Token-{self.token_id} 获取成功 ({(time.time()-start_ts)*1000:.0f}ms)")
-                        return token
-                    
-                    self._error_count += 1
-                    debug_logger.log_warning(f"[BrowserCaptcha] Token-{self.token_id} 尝试 {attempt+1}/{MAX_RETRIES} 失败")
-                    
-                except Exception as e:
-                    self._error_count += 1
-                    debug_logger.log_error(f"[BrowserCaptcha] Token-{self.token_id} 浏览器错误: {type(e).__name__}: {str(e)[:200]}")
-                finally:
-                    # 无论成功失败都关闭浏览器
-                    await self._close_browser(playwright, browser, context)
                 
-                # 重试前等待
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(1)
+                if token:
+                    self._solve_count += 1
+                    debug_logger.log_info(f"[BrowserCaptcha] Token-{self.token_id} 获取成功 ({(time.time()-start_ts)*1000:.0f}ms)")
+                    return token
+                
+                self._error_count += 1
+                debug_logger.log_warning(f"[BrowserCaptcha] Token-{self.token_id} 尝试 {attempt+1}/{MAX_RETRIES} 失败")
+                
+            except Exception as e:
+                self._error_count += 1
+                debug_logger.log_error(f"[BrowserCaptcha] Token-{self.token_id} 浏览器错误: {type(e).__name__}: {str(e)[:200]}")
+            finally:
+                # 无论成功失败都断开浏览器
+                await self._close_browser(browser, context)
             
-            return None
+            # 重试前等待
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(1)
+        
+        return None
     
 
 class BrowserCaptchaService:
@@ -346,18 +541,25 @@ class BrowserCaptchaService:
     """
     
     _instance: Optional['BrowserCaptchaService'] = None
-    _lock = asyncio.Lock()
+    _lock: Optional[asyncio.Lock] = None  # 在 get_instance 中按需创建
+    
+    # 固定值，打码页 HTML 由 _recaptcha_page_html 按 key 缓存
+    website_key = "6LdsFiUsAAAAAIjVDZcuLhaHiDn5nnHVXVRQGeMV"
+    
+    __slots__ = (
+        'db', 'base_user_data_dir',
+        '_browsers', '_browser_count', '_rr', '_stats',
+        '_unavailable_reason', '_admit_cond', '_admit_active', '_admit_max',
+    )
     
     def __init__(self, db=None):
         self.db = db
-        self.website_key = "6LdsFiUsAAAAAIjVDZcuLhaHiDn5nnHVXVRQGeMV"
-        self.base_user_data_dir = os.path.join(os.getcwd(), "browser_data_rt")
-        self._browsers: Dict[int, TokenBrowser] = {}
-        self._browsers_lock = asyncio.Lock()
+        self.base_user_data_dir = Path.cwd() / "browser_data_rt"
+        self._browsers: List[Optional[TokenBrowser]] = [None]  # 下标即 browser_id
         
         # 浏览器数量配置
         self._browser_count = 1  # 默认 1 个，会从数据库加载
-        self._round_robin_index = 0  # 轮询索引
+        self._rr = itertools.cycle(range(self._browser_count))  # 轮询迭代器
         
         # 统计指标
         self._stats = {
@@ -367,34 +569,51 @@ class BrowserCaptchaService:
             "api_403": 0
         }
         
-        # 并发限制将在 _load_browser_count 中根据配置设置
-        self._token_semaphore = None
+        # get_instance 会先等待 _bootstrap 完成，此后可用性不再变化，只需计算一次
+        self._unavailable_reason = self._get_unavailable_reason()
+        
+        # 并发限制：在 _admit_cond 上等待 _admit_active < _admit_max，
+        # 上限由 _load_browser_count 根据配置设置，可热更新
+        self._admit_cond = asyncio.Condition()
+        self._admit_active = 0
+        self._admit_max = self._browser_count
     
     @classmethod
     async def get_instance(cls, db=None) -> 'BrowserCaptchaService':
         if cls._instance is None:
+            if cls._lock is None:
+                cls._lock = asyncio.Lock()
             async with cls._lock:
                 if cls._instance is None:
+                    await _ensure_bootstrapped()
                     cls._instance = cls(db)
                     # 从数据库加载 browser_count 配置
                     await cls._instance._load_browser_count()
         return cls._instance
     
-    def _check_available(self):
-        """检查服务是否可用"""
+    @staticmethod
+    def _get_unavailable_reason() -> Optional[str]:
+        """返回服务不可用的原因，可用时返回 None"""
         if IS_DOCKER:
-            raise RuntimeError(
+            return (
                 "有头浏览器打码在 Docker 环境中不可用。"
                 "请使用第三方打码服务: yescaptcha, capmonster, ezcaptcha, capsolver"
             )
         if not PLAYWRIGHT_AVAILABLE or async_playwright is None:
-            raise RuntimeError(
+            return (
                 "playwright 未安装或不可用。"
                 "请手动安装: pip install playwright && python -m playwright install chromium"
             )
+        return None
+
+    def _check_available(self):
+        """检查服务是否可用"""
+        if self._unavailable_reason:
+            raise RuntimeError(self._unavailable_reason)
     
     async def _load_browser_count(self):
         """从数据库加载浏览器数量配置"""
+        old_count = self._browser_count
         if self.db:
             try:
                 captcha_config = await self.db.get_captcha_config()
@@ -403,50 +622,72 @@ class BrowserCaptchaService:
             except Exception as e:
                 debug_logger.log_warning(f"[BrowserCaptcha] 加载 browser_count 配置失败: {e}，使用默认值 1")
                 self._browser_count = 1
+        if self._browser_count != old_count:
+            self._rr = itertools.cycle(range(self._browser_count))
+            self._resize_browsers()
         # 并发限制 = 浏览器数量，不再硬编码限制
-        self._token_semaphore = asyncio.Semaphore(self._browser_count)
+        # 只调整上限并唤醒等待者，已在排队的请求不会因为换了新对象而被遗留
+        self._admit_max = self._browser_count
+        async with self._admit_cond:
+            self._admit_cond.notify_all()
         debug_logger.log_info(f"[BrowserCaptcha] 并发上限: {self._browser_count}")
     
     async def reload_browser_count(self):
         """重新加载浏览器数量配置（用于配置更新后热重载）"""
-        old_count = self._browser_count
         await self._load_browser_count()
-        
-        # 如果数量减少，移除多余的浏览器实例
-        if self._browser_count < old_count:
-            async with self._browsers_lock:
-                for browser_id in list(self._browsers.keys()):
-                    if browser_id >= self._browser_count:
-                        self._browsers.pop(browser_id)
-                        debug_logger.log_info(f"[BrowserCaptcha] 移除多余浏览器实例 {browser_id}")
-    
-    def _log_stats(self):
-        total = self._stats["req_total"]
-        gen_fail = self._stats["gen_fail"]
-        api_403 = self._stats["api_403"]
-        gen_ok = self._stats["gen_ok"]
-        
-        valid_success = gen_ok - api_403
-        if valid_success < 0: valid_success = 0
-        
-        rate = (valid_success / total * 100) if total > 0 else 0.0
 
+    @contextlib.asynccontextmanager
+    async def _admission(self):
+        """占用一个并发名额，退出时归还并唤醒一个等待者"""
+        async with self._admit_cond:
+            try:
+                await self._admit_cond.wait_for(lambda: self._admit_active < self._admit_max)
+            except asyncio.CancelledError:
+                # 被唤醒后又被取消时，Condition 会吞掉这次通知，转交给下一个等待者
+                self._admit_cond.notify(1)
+                raise
+            self._admit_active += 1
+        try:
+            yield
+        finally:
+            # 先同步归还名额；唤醒需要重新拿锁，放进 shield 里，
+            # 即使当前任务在等锁时再次被取消，通知也不会丢
+            self._admit_active -= 1
+            await asyncio.shield(self._notify_admission())
+
+    async def _notify_admission(self):
+        async with self._admit_cond:
+            self._admit_cond.notify(1)
+
+    def _resize_browsers(self):
+        """按 browser_count 调整实例列表，数量减少时移除多余的浏览器实例
+
+        构造新列表后整体替换引用，不原地修改旧列表；中间没有 await，无需加锁。
+        被移除的实例上正在进行的打码不受影响，结束后随旧引用一起释放
+        """
+        count = self._browser_count
+        old = self._browsers
+        self._browsers = old[:count] + [None] * (count - len(old))
+        for browser_id, browser in enumerate(old[count:], count):
+            if browser is not None:
+                debug_logger.log_info(f"[BrowserCaptcha] 移除多余浏览器实例 {browser_id}")
     
-    async def _get_or_create_browser(self, browser_id: int) -> TokenBrowser:
-        """获取或创建指定 ID 的浏览器实例"""
-        async with self._browsers_lock:
-            if browser_id not in self._browsers:
-                user_data_dir = os.path.join(self.base_user_data_dir, f"browser_{browser_id}")
-                browser = TokenBrowser(browser_id, user_data_dir, db=self.db)
-                self._browsers[browser_id] = browser
-                debug_logger.log_info(f"[BrowserCaptcha] 创建浏览器实例 {browser_id}")
-            return self._browsers[browser_id]
+    def _get_or_create_browser(self, browser_id: int) -> TokenBrowser:
+        """获取或创建指定 ID 的浏览器实例
+
+        查找和创建之间没有 await，在事件循环内天然原子，读路径无需加锁
+        """
+        browser = self._browsers[browser_id]
+        if browser is None:
+            user_data_dir = os.fspath(self.base_user_data_dir / f"browser_{browser_id}")
+            browser = TokenBrowser(browser_id, user_data_dir, db=self.db)
+            self._browsers[browser_id] = browser
+            debug_logger.log_info(f"[BrowserCaptcha] 创建浏览器实例 {browser_id}")
+        return browser
     
     def _get_next_browser_id(self) -> int:
         """轮询获取下一个浏览器 ID"""
-        browser_id = self._round_robin_index % self._browser_count
-        self._round_robin_index += 1
-        return browser_id
+        return next(self._rr)
     
     async def get_token(self, project_id: str, action: str = "IMAGE_GENERATION", token_id: int = None) -> tuple[Optional[str], int]:
         """获取 reCAPTCHA Token（轮询分配到不同浏览器）
@@ -464,35 +705,18 @@ class BrowserCaptchaService:
         
         self._stats["req_total"] += 1
         
-        # 全局并发限制（如果已配置）
-        if self._token_semaphore:
-            async with self._token_semaphore:
-                # 轮询选择浏览器
-                browser_id = self._get_next_browser_id()
-                browser = await self._get_or_create_browser(browser_id)
-                
-                token = await browser.get_token(project_id, self.website_key, action)
+        # 全局并发限制
+        async with self._admission():
+            # 轮询选择浏览器（同步完成，拿到名额后直接开始打码）
+            browser = self._get_or_create_browser(self._get_next_browser_id())
+            browser_id = browser.token_id
             
-            if token:
-                self._stats["gen_ok"] += 1
-            else:
-                self._stats["gen_fail"] += 1
-                
-            self._log_stats()
-            return token, browser_id
-        
-        # 无并发限制时直接执行
-        browser_id = self._get_next_browser_id()
-        browser = await self._get_or_create_browser(browser_id)
-        
-        token = await browser.get_token(project_id, self.website_key, action)
+            token = await browser.get_token(project_id, self.website_key, action)
         
         if token:
             self._stats["gen_ok"] += 1
         else:
             self._stats["gen_fail"] += 1
-            
-        self._log_stats()
         return token, browser_id
 
     async def report_error(self, browser_id: int = None):
@@ -501,19 +725,17 @@ class BrowserCaptchaService:
         Args:
             browser_id: 浏览器 ID（当前架构下每次都是新浏览器，此参数仅用于日志）
         """
-        async with self._browsers_lock:
-            self._stats["api_403"] += 1
-            if browser_id is not None:
-                debug_logger.log_info(f"[BrowserCaptcha] 浏览器 {browser_id} 的 token 验证失败")
+        self._stats["api_403"] += 1
+        if browser_id is not None:
+            debug_logger.log_info(f"[BrowserCaptcha] 浏览器 {browser_id} 的 token 验证失败")
 
     async def remove_browser(self, browser_id: int):
-        async with self._browsers_lock:
-            if browser_id in self._browsers:
-                self._browsers.pop(browser_id)
+        if 0 <= browser_id < len(self._browsers):
+            self._browsers[browser_id] = None
 
     async def close(self):
-        async with self._browsers_lock:
-            self._browsers.clear()
+        self._browsers = [None] * self._browser_count
+        await _stop_playwright()
             
     async def open_login_browser(self): return {"success": False, "error": "Not implemented"}
     async def create_browser_for_token(self, t, s=None): pass
@@ -527,13 +749,12 @@ class BrowserCaptchaService:
     ) -> tuple:
         """Solve captcha on antcpt.com and read score from page DOM. Returns (payload_dict, browser_id)."""
         token_start = time.time()
-        playwright = None
         browser = None
         context = None
 
         try:
             # Connect directly to Chrome CDP — no need for a TokenBrowser from the pool
-            playwright = await async_playwright().start()
+            playwright = await _get_playwright()
             browser = await playwright.chromium.connect_over_cdp(TokenBrowser.CDP_ENDPOINT)
             contexts = browser.contexts
             context = contexts[0] if contexts else await browser.new_context()
@@ -550,31 +771,7 @@ class BrowserCaptchaService:
                 raw_text = ""
                 for _ in range(50):  # up to 25 seconds
                     await asyncio.sleep(0.5)
-                    result = await page.evaluate("""
-                        (() => {
-                            const bodyText = ((document.body && document.body.innerText) || "")
-                                .replace(/\\u00a0/g, " ").replace(/\\r/g, "");
-                            const patterns = [
-                                { source: "current_score", regex: /Your score is:\\s*([01](?:\\.\\d+)?)/i },
-                                { source: "selected_score", regex: /Selected Score Test:[\\s\\S]{0,400}?Score:\\s*([01](?:\\.\\d+)?)/i },
-                                { source: "history_score", regex: /(?:^|\\n)\\s*Score:\\s*([01](?:\\.\\d+)?)\\s*;/i },
-                            ];
-                            let score = null; let source = "";
-                            for (const item of patterns) {
-                                const match = bodyText.match(item.regex);
-                                if (!match) continue;
-                                const parsed = Number(match[1]);
-                                if (!Number.isNaN(parsed) && parsed >= 0 && parsed <= 1) {
-                                    score = parsed; source = item.source; break;
-                                }
-                            }
-                            const uaMatch = bodyText.match(/Current User Agent:\\s*([^\\n]+)/i);
-                            const ipMatch = bodyText.match(/Current IP Address:\\s*([^\\n]+)/i);
-                            return { score, source, raw_text: bodyText.slice(0, 4000),
-                                     current_user_agent: uaMatch ? uaMatch[1].trim() : "",
-                                     current_ip_address: ipMatch ? ipMatch[1].trim() : "" };
-                        })()
-                    """)
+                    result = await page.evaluate(_READ_SCORE_JS)
                     if isinstance(result, dict):
                         raw_text = result.get("raw_text", "")
                         s = result.get("score")
@@ -606,7 +803,7 @@ class BrowserCaptchaService:
                 }, 0
             finally:
                 try: await page.close()
-                except: pass
+                except Exception: pass
         except Exception as e:
             return {
                 "token": None, "token_elapsed_ms": int((time.time() - token_start) * 1000),
@@ -614,12 +811,10 @@ class BrowserCaptchaService:
                 "verify_result": {"success": False, "error": f"{type(e).__name__}: {str(e)[:300]}"},
             }, None
         finally:
+            # 只断开 CDP 连接，共享的 playwright driver 保持运行
             try:
                 if browser: await browser.close()
-            except: pass
-            try:
-                if playwright: await playwright.stop()
-            except: pass
+            except Exception: pass
 
     async def get_fingerprint(self, browser_id: int = None):
         """CDP approach has no per-browser fingerprint — Chrome provides its own identity."""
@@ -634,7 +829,7 @@ class BrowserCaptchaService:
             "total_solve_count": self._stats["gen_ok"],
             "total_error_count": self._stats["gen_fail"],
             "risk_403_count": self._stats["api_403"],
-            "browser_count": len(self._browsers),
+            "browser_count": sum(1 for b in self._browsers if b is not None),
             "configured_browser_count": self._browser_count,
             "browsers": []
         }
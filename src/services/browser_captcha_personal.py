@@ -8,6 +8,7 @@ import time
 import os
 import sys
 import subprocess
+import functools
 from typing import Optional, Dict, Any
 
 from ..core.logger import debug_logger
@@ -15,16 +16,17 @@ from ..core.config import config
 
 
 # ==================== Docker 环境检测 ====================
+@functools.lru_cache(maxsize=1)
 def _is_running_in_docker() -> bool:
-    """检测是否在 Docker 容器中运行"""
+    """检测是否在 Docker 容器中运行（结果在进程内缓存）"""
     # 方法1: 检查 /.dockerenv 文件
     if os.path.exists('/.dockerenv'):
         return True
-    # 方法2: 检查 cgroup
+    # 方法2: 检查 cgroup（按字节读取，省去解码）
     try:
-        with open('/proc/1/cgroup', 'r') as f:
+        with open('/proc/1/cgroup', 'rb') as f:
             content = f.read()
-            if 'docker' in content or 'kubepods' in content or 'containerd' in content:
+            if any(s in content for s in (b'docker', b'kubepods', b'containerd')):
                 return True
     except:
         pass
@@ -1029,11 +1031,14 @@ class BrowserCaptchaService:
                 except Exception:
                     pass
 
-    def get_last_fingerprint(self) -> Optional[Dict[str, Any]]:
-        """返回最近一次打码时的浏览器指纹快照。"""
+    def get_last_fingerprint(self, copy: bool = True) -> Optional[Dict[str, Any]]:
+        """返回最近一次打码时的浏览器指纹快照。
+
+        指纹每次打码都会整体替换、不会原地修改；只读或自行复制的调用方可传 copy=False 省去拷贝。
+        """
         if not self._last_fingerprint:
             return None
-        return dict(self._last_fingerprint)
+        return dict(self._last_fingerprint) if copy else self._last_fingerprint
 
     async def close(self):
         """关闭浏览器"""
@@ -1302,7 +1302,8 @@ class FlowClient:
                 from .browser_captcha_personal import BrowserCaptchaService
                 service = await BrowserCaptchaService.get_instance(self.db)
                 token = await service.get_token(project_id, action)
-                fingerprint = service.get_last_fingerprint() if token else None
+                # _set_request_fingerprint 会自行复制一份
+                fingerprint = service.get_last_fingerprint(copy=False) if token else None
                 self._set_request_fingerprint(fingerprint if token else None)
                 return token, None
             except RuntimeError as e: